@@ -99,9 +99,17 @@ class PaddleOCRBackend(OCRBackend):
                 "use_gpu": False,
                 "text_det_limit_type": "max",
                 "text_det_limit_side_len": 960,
-                "use_doc_orientation_classify": True,  # Enable document orientation classification / 启用文档方向分类
+                # Enable document orientation classification / 启用文档方向分类
+                "use_doc_orientation_classify": os.getenv(
+                    "OCR_USE_DOC_ORIENTATION_CLASSIFY", "true"
+                ).lower()
+                == "true",
                 "use_doc_unwarping": False,
-                "use_textline_orientation": True,  # Enable text line orientation detection / 启用文本行方向检测
+                # Enable text line orientation detection / 启用文本行方向检测
+                "use_textline_orientation": os.getenv(
+                    "OCR_USE_TEXTLINE_ORIENTATION", "true"
+                ).lower()
+                == "true",
                 "text_recognition_model_name": "PP-OCRv4_server_rec",
                 "text_detection_model_name": "PP-OCRv4_server_det",
                 "text_det_thresh": 0.3,
@@ -1,8 +1,31 @@
+import functools
 import re
-from typing import Callable, Dict, List, Match, Pattern, Union
+from dataclasses import dataclass, field
+from typing import (
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Match,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from pydantic import BaseModel, Field
 
+# 按请求构造自定义配置（如不同租户的Markdown风格）时复用已编译的正则，
+# 使用有界的LRU缓存避免内存无限增长
+_PATTERN_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=_PATTERN_CACHE_SIZE)
+def _compile(pattern: str, flags: int) -> Pattern[str]:
+    """编译正则，相同的 (pattern, flags) 复用已编译的结果"""
+    return re.compile(pattern, flags)
+
 
 class HeaderTrackerHook(BaseModel):
     """表头追踪Hook的配置类，支持多种场景的表头识别"""
@@ -19,6 +42,10 @@ class HeaderTrackerHook(BaseModel):
     case_sensitive: bool = Field(
         default=True, description="是否大小写敏感（仅当传入字符串pattern时生效）"
     )
+    start_required_chars: FrozenSet[str] = Field(
+        default=frozenset(),
+        description="start_pattern命中所必需的字符（split缺少其中任一字符时跳过正则匹配）",
+    )
 
     def __init__(
         self,
@@ -28,9 +55,9 @@ class HeaderTrackerHook(BaseModel):
     ):
         flags = 0 if kwargs.get("case_sensitive", True) else re.IGNORECASE
         if isinstance(start_pattern, str):
-            start_pattern = re.compile(start_pattern, flags | re.DOTALL)
+            start_pattern = _compile(start_pattern, flags | re.DOTALL)
         if isinstance(end_pattern, str):
-            end_pattern = re.compile(end_pattern, flags | re.DOTALL)
+            end_pattern = _compile(end_pattern, flags | re.DOTALL)
         super().__init__(
             start_pattern=start_pattern,
             end_pattern=end_pattern,
@@ -39,7 +66,8 @@ class HeaderTrackerHook(BaseModel):
 
 
 # 初始化表头Hook配置（提供默认配置：支持Markdown表格、代码块）
-DEFAULT_CONFIGS = [
+# 使用tuple防止被修改，合并正则在导入时基于它预编译
+_DEFAULT_CONFIG_LIST = [
     # 代码块配置（```开头，```结尾）
     # HeaderTrackerHook(
     #     # 代码块开始（支持语言指定）
@@ -53,47 +81,139 @@ DEFAULT_CONFIGS = [
     # Markdown表格配置（表头带下划线）
     HeaderTrackerHook(
         # 表头行 + 分隔行
-        start_pattern=r"^\s*(?:\|[^|\n]*)+[\r\n]+\s*(?:\|\s*:?-{3,}:?\s*)+\|?[\r\n]+$",
+        # 重复分组内的字符类互不重叠（单元格不含换行，分隔行内只匹配换行以外的空白，
+        # 包括全角空格），每个位置只有一种匹配方式，避免回溯爆炸
+        start_pattern=r"^\s*(?:\|[^|\r\n]*)+[\r\n]+[^\S\r\n]*(?:\|[^\S\r\n]*:?-{3,}:?[^\S\r\n]*)+\|?[\r\n]+$",
         # 空行或非表格内容
         end_pattern=r"^\s*$|^\s*[^|\s].*$",
         priority=15,
         case_sensitive=False,
+        start_required_chars=frozenset("|-"),
     ),
 ]
-DEFAULT_CONFIGS.sort(key=lambda x: -x.priority)
+DEFAULT_CONFIGS: Tuple[HeaderTrackerHook, ...] = tuple(
+    sorted(_DEFAULT_CONFIG_LIST, key=lambda x: -x.priority)
+)
+
+# 可以通过内联分组限定作用范围的正则flags
+_SCOPED_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"))
+
+
+def _fuse_patterns(patterns: Sequence[Pattern[str]]) -> Pattern[str]:
+    """将多个正则合并为一个交替正则，每个分组通过内联flags保留原有的匹配语义
+
+    合并后只需一次search即可判断是否有任一pattern命中，
+    命中的分组名（_hook{i}）对应patterns中的下标。
+    """
+    parts = []
+    for i, pattern in enumerate(patterns):
+        on = "".join(c for flag, c in _SCOPED_FLAGS if pattern.flags & flag)
+        off = "".join(c for flag, c in _SCOPED_FLAGS if not pattern.flags & flag)
+        scoped = f"{on}-{off}" if off else on
+        parts.append(f"(?P<_hook{i}>(?{scoped}:{pattern.pattern}))")
+    return re.compile("|".join(parts))
+
+
+# 默认配置的合并正则（导入时预编译一次）
+_DEFAULT_START_RE = _fuse_patterns([c.start_pattern for c in DEFAULT_CONFIGS])
+_DEFAULT_END_RE = _fuse_patterns([c.end_pattern for c in DEFAULT_CONFIGS])
+# 合并正则的分组名 -> 对应的默认配置
+_DEFAULT_GROUP_CONFIGS = {f"_hook{i}": c for i, c in enumerate(DEFAULT_CONFIGS)}
+
+
+def _has_chars(split: str, chars: FrozenSet[str]) -> bool:
+    """split是否包含chars中的所有字符"""
+    return all(c in split for c in chars)
 
 
 # 定义Hook状态数据结构
-class HeaderTracker(BaseModel):
+# 状态只在内部使用且每个split都会更新，使用slots dataclass避免pydantic的校验开销
+@dataclass(slots=True)
+class HeaderTracker:
     """表头追踪 Hook 的状态类"""
 
-    header_hook_configs: List[HeaderTrackerHook] = Field(default=DEFAULT_CONFIGS)
-    active_headers: Dict[int, str] = Field(default_factory=dict)
-    ended_headers: set[int] = Field(default_factory=set)
+    # None表示使用DEFAULT_CONFIGS，此时update中使用预编译的合并正则
+    header_hook_configs: Optional[Sequence[HeaderTrackerHook]] = None
+    active_headers: Dict[int, str] = field(default_factory=dict)
+    ended_headers: set[int] = field(default_factory=set)
+
+    # get_headers 的缓存结果，active_headers 变化时置脏
+    _headers_cache: Optional[str] = field(default=None, init=False, repr=False)
+    _headers_dirty: bool = field(default=True, init=False, repr=False)
+
+    def _search_configs(
+        self,
+        split: str,
+        fused_re: Pattern[str],
+        get_pattern: Callable[[HeaderTrackerHook], Pattern[str]],
+        eligible: Callable[[HeaderTrackerHook], bool],
+        rematch: bool,
+    ) -> List[Tuple[HeaderTrackerHook, Match[str]]]:
+        """返回pattern命中split的所有eligible配置及其匹配结果
+
+        先筛选出eligible的配置，没有时不进入正则引擎。默认配置用合并正则search一次：
+        未命中直接返回；命中时通过lastgroup找到对应配置，rematch为True时只用该配置
+        自身的pattern重新search（保证extract_header_fn拿到的分组编号不变），否则直接
+        使用合并正则的匹配结果。其余eligible配置（多个默认配置时）仍逐个匹配。
+        """
+        results: List[Tuple[HeaderTrackerHook, Match[str]]] = []
+        use_fused = self.header_hook_configs is None
+        configs = DEFAULT_CONFIGS if use_fused else self.header_hook_configs
+        candidates = [config for config in configs if eligible(config)]
+        if not candidates:
+            return results
+
+        if use_fused:
+            fused_match = fused_re.search(split)
+            if fused_match is None:
+                return results
+            hit = _DEFAULT_GROUP_CONFIGS[fused_match.lastgroup]
+            if any(config is hit for config in candidates):
+                match = get_pattern(hit).search(split) if rematch else fused_match
+                if match:
+                    results.append((hit, match))
+                candidates = [config for config in candidates if config is not hit]
+
+        for config in candidates:
+            match = get_pattern(config).search(split)
+            if match:
+                results.append((config, match))
+        return results
 
     def update(self, split: str) -> Dict[int, str]:
         """检测当前split中的表头开始/结束，更新Hook状态"""
         new_headers: Dict[int, str] = {}
 
         # 1. 检查是否有表头结束标记
-        for config in self.header_hook_configs:
-            if config.priority in self.active_headers and config.end_pattern.search(
-                split
+        if self.active_headers:
+            for config, _ in self._search_configs(
+                split,
+                _DEFAULT_END_RE,
+                lambda c: c.end_pattern,
+                lambda c: c.priority in self.active_headers,
+                rematch=False,
             ):
                 self.ended_headers.add(config.priority)
                 del self.active_headers[config.priority]
+                self._headers_dirty = True
 
         # 2. 检查是否有新的表头开始标记（只处理未活跃且未结束的）
-        for config in self.header_hook_configs:
-            if (
-                config.priority not in self.active_headers
-                and config.priority not in self.ended_headers
-            ):
-                match = config.start_pattern.search(split)
-                if match:
-                    header = config.extract_header_fn(match)
-                    self.active_headers[config.priority] = header
-                    new_headers[config.priority] = header
+        # 字符预检过滤掉绝大多数不含表头的split，避免进入正则引擎
+        for config, match in self._search_configs(
+            split,
+            _DEFAULT_START_RE,
+            lambda c: c.start_pattern,
+            lambda c: (
+                c.priority not in self.active_headers
+                and c.priority not in self.ended_headers
+                and _has_chars(split, c.start_required_chars)
+            ),
+            rematch=True,
+        ):
+            header = config.extract_header_fn(match)
+            self.active_headers[config.priority] = header
+            new_headers[config.priority] = header
+            self._headers_dirty = True
 
         # 3. 检查是否所有活跃表头都已结束（清空结束标记）
         if not self.active_headers:
@@ -103,10 +223,15 @@ class HeaderTracker(BaseModel):
 
     def get_headers(self) -> str:
         """获取当前所有活跃表头的拼接文本（按优先级排序）"""
+        if not self._headers_dirty:
+            return self._headers_cache
+
         # 按优先级降序排列表头
         sorted_headers = sorted(self.active_headers.items(), key=lambda x: -x[0])
-        return (
+        self._headers_cache = (
             "\n".join([header for _, header in sorted_headers])
             if sorted_headers
             else ""
         )
+        self._headers_dirty = False
+        return self._headers_cache
@@ -1,27 +1,46 @@
-import contextlib
 import logging
 import time
 import uuid
 from contextvars import ContextVar
 from logging import LogRecord
-from typing import Optional
+from typing import Optional, Tuple
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 定义上下文变量
-request_id_var = ContextVar("request_id", default=None)
-_request_start_time_ctx = ContextVar("request_start_time", default=None)
+# 定义上下文变量: (完整请求ID, 日志中显示的短ID, 请求开始时间(time.monotonic_ns))
+_request_ctx: ContextVar[Optional[Tuple[str, str, Optional[int]]]] = ContextVar(
+    "request_ctx", default=None
+)
+
+
+def _short_request_id(request_id: str) -> str:
+    """计算日志中显示的短格式请求ID"""
+    if len(request_id) <= 8:
+        return request_id
+
+    # 截取ID的前8个字符，确保显示整齐
+    short_id = request_id[:8]
+    if "-" in request_id:
+        # 尝试保留格式，例如 test-req-1-XXX
+        parts = request_id.split("-")
+        if len(parts) >= 3:
+            # 如果格式是 xxx-xxx-n-randompart
+            short_id = f"{parts[0]}-{parts[1]}-{parts[2]}"
+    return short_id
 
 
 def set_request_id(request_id: str) -> None:
     """设置当前上下文的请求ID"""
-    request_id_var.set(request_id)
+    ctx = _request_ctx.get()
+    start_ns = ctx[2] if ctx is not None else None
+    _request_ctx.set((request_id, _short_request_id(request_id), start_ns))
 
 
 def get_request_id() -> Optional[str]:
     """获取当前上下文的请求ID"""
-    return request_id_var.get()
+    ctx = _request_ctx.get()
+    return ctx[0] if ctx is not None else None
 
 
 class MillisecondFormatter(logging.Formatter):
@@ -44,6 +63,18 @@ class MillisecondFormatter(logging.Formatter):
         return result
 
 
+class RequestIdFormatter(logging.Formatter):
+    """日志格式化器，在消息后追加请求执行时间(elapsed_ms由RequestIdFilter设置)"""
+
+    def formatMessage(self, record: LogRecord) -> str:
+        result = super().formatMessage(record)
+        # 只有在请求上下文中的日志才带有elapsed_ms属性
+        elapsed_ms = getattr(record, "elapsed_ms", None)
+        if elapsed_ms is not None:
+            result = f"{result} (elapsed: {elapsed_ms}ms)"
+        return result
+
+
 def init_logging_request_id():
     """
     Initialize logging to include request ID in log messages.
@@ -54,11 +85,16 @@ def init_logging_request_id():
 
     # 添加自定义过滤器到所有处理器
     for handler in root_logger.handlers:
-        # 添加请求ID过滤器
-        handler.addFilter(RequestIdFilter())
+        # 添加请求ID过滤器（重复初始化时不重复添加，避免每条日志执行多次filter）
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+
+        # 已经设置过请求ID格式化器的处理器无需再替换
+        if isinstance(handler.formatter, RequestIdFormatter):
+            continue
 
         # 更新格式化器以包含请求ID，调整格式使其更紧凑整齐
-        formatter = logging.Formatter(
+        formatter = RequestIdFormatter(
             fmt="%(asctime)s.%(msecs)03d [%(request_id)s] %(levelname)-5s %(name)-20s | %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
         )
@@ -71,7 +107,7 @@ def init_logging_request_id():
     # 如果没有处理器，添加一个标准输出处理器
     if not root_logger.handlers:
         handler = logging.StreamHandler()
-        formatter = logging.Formatter(
+        formatter = RequestIdFormatter(
             fmt="%(asctime)s.%(msecs)03d [%(request_id)s] %(levelname)-5s %(name)-20s | %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
         )
@@ -82,34 +118,23 @@ def init_logging_request_id():
 
 
 class RequestIdFilter(logging.Filter):
-    """Filter that adds request ID to log messages"""
+    """Filter that adds request ID to log messages
+
+    The filter is attached to handlers, so it only runs for records that
+    already passed the logger and handler level checks. It does a single
+    ContextVar read per record.
+    """
 
     def filter(self, record: LogRecord) -> bool:
-        request_id = request_id_var.get()
-        if request_id is not None:
-            # 为日志记录添加请求ID属性，使用短格式
-            if len(request_id) > 8:
-                # 截取ID的前8个字符，确保显示整齐
-                short_id = request_id[:8]
-                if "-" in request_id:
-                    # 尝试保留格式，例如 test-req-1-XXX
-                    parts = request_id.split("-")
-                    if len(parts) >= 3:
-                        # 如果格式是 xxx-xxx-n-randompart
-                        short_id = f"{parts[0]}-{parts[1]}-{parts[2]}"
-                record.request_id = short_id
-            else:
-                record.request_id = request_id
-
-            # 添加执行时间属性
-            start_time = _request_start_time_ctx.get()
-            if start_time is not None:
-                elapsed_ms = int((time.time() - start_time) * 1000)
-                record.elapsed_ms = elapsed_ms
-                # 添加执行时间到消息中
-                if not hasattr(record, "message_with_elapsed"):
-                    record.message_with_elapsed = True
-                    record.msg = f"{record.msg} (elapsed: {elapsed_ms}ms)"
+        ctx = _request_ctx.get()
+        if ctx is not None:
+            # 为日志记录添加请求ID属性，短格式在设置上下文时已计算好
+            _, record.request_id, start_ns = ctx
+
+            # 添加执行时间属性（单调时钟，整数运算，不受系统时间调整影响）
+            if start_ns is not None:
+                # 执行时间由RequestIdFormatter在格式化时追加到消息后
+                record.elapsed_ms = (time.monotonic_ns() - start_ns) // 1_000_000
         else:
             # 如果没有请求ID，使用占位符
             record.request_id = "no-req-id"
@@ -117,8 +142,39 @@ class RequestIdFilter(logging.Filter):
         return True
 
 
-@contextlib.contextmanager
-def request_id_context(request_id: str = None):
+class RequestIdContext:
+    """Context manager that sets a request ID for the current context
+
+    Implemented as a plain class instead of ``contextlib.contextmanager`` so
+    entering a request does not allocate a generator per call.
+    """
+
+    __slots__ = ("req_id", "start_ns", "token")
+
+    def __init__(self, request_id: Optional[str] = None):
+        # Generate or use provided request ID
+        self.req_id = request_id or str(uuid.uuid4())
+        self.start_ns: Optional[int] = None
+        self.token = None
+
+    def __enter__(self) -> str:
+        # Set start time and request ID
+        self.start_ns = time.monotonic_ns()
+        self.token = _request_ctx.set(
+            (self.req_id, _short_request_id(self.req_id), self.start_ns)
+        )
+
+        logger.info(f"Starting new request with ID: {self.req_id}")
+        return self.req_id
+
+    def __exit__(self, *exc_info) -> None:
+        # Log completion and reset context var
+        elapsed_ms = (time.monotonic_ns() - self.start_ns) // 1_000_000
+        logger.info(f"Request {self.req_id} completed in {elapsed_ms}ms")
+        _request_ctx.reset(self.token)
+
+
+def request_id_context(request_id: str = None) -> RequestIdContext:
     """Context manager that sets a request ID for the current context
 
     Args:
@@ -129,21 +185,4 @@ def request_id_context(request_id: str = None):
             # 在这个代码块中的所有日志都会包含请求ID req-123
             logging.info("Processing request")
     """
-    # Generate or use provided request ID
-    req_id = request_id or str(uuid.uuid4())
-
-    # Set start time and request ID
-    start_time = time.time()
-    req_token = request_id_var.set(req_id)
-    time_token = _request_start_time_ctx.set(start_time)
-
-    logger.info(f"Starting new request with ID: {req_id}")
-
-    try:
-        yield request_id_var.get()
-    finally:
-        # Log completion and reset context vars
-        elapsed_ms = int((time.time() - start_time) * 1000)
-        logger.info(f"Request {req_id} completed in {elapsed_ms}ms")
-        request_id_var.reset(req_token)
-        _request_start_time_ctx.reset(time_token)
+    return RequestIdContext(request_id)
@@ -1,9 +1,26 @@
+import asyncio
+import contextlib
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import torch
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel, Field
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+# ORJSONResponse 只在序列化时才检查 orjson 是否安装，未安装时退回默认的 JSONResponse，
+# 避免服务启动后每个响应都返回 500
+try:
+    import orjson  # noqa: F401
+
+    DefaultResponse = ORJSONResponse
+except ImportError:
+    print("未安装 orjson，使用默认的 JSONResponse")
+    DefaultResponse = JSONResponse
 
 # --- 1. 定义API的请求和响应数据结构 ---
 
@@ -36,11 +53,30 @@ class TestFinalResponse(BaseModel):
 print("正在加载模型，请稍候...")
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"使用的设备: {device}")
+# GPU 上使用半精度推理：支持 BF16 的显卡用 BF16，较老的显卡用 FP16；CPU 保持 FP32
+if device.type == "cuda":
+    model_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+else:
+    model_dtype = torch.float32
+print(f"推理精度: {model_dtype}")
 try:
     # 请确保这里的路径是正确的
     model_path = '/data1/home/lwx/work/Download/rerank_model_weight'
     tokenizer = AutoTokenizer.from_pretrained(model_path)
-    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    model = None
+    if device.type == "cuda":
+        # GPU 上优先使用 SDPA 注意力（可走 FlashAttention 等融合内核），
+        # 当前 transformers 版本或模型结构不支持时退回默认实现
+        try:
+            model = AutoModelForSequenceClassification.from_pretrained(
+                model_path, torch_dtype=model_dtype, attn_implementation="sdpa"
+            )
+        except (ValueError, ImportError) as e:
+            print(f"不支持 SDPA 注意力，使用默认实现: {e}")
+    if model is None:
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_path, torch_dtype=model_dtype
+        )
     model.to(device)
     model.eval()
     print("模型加载成功！")
@@ -49,45 +85,241 @@ except Exception as e:
     # 在测试环境中，如果模型加载失败，可以考虑退出以避免运行一个无效的服务
     exit()
 
+# 每个子批次包含的 (query, doc) 对数量
+RERANK_BATCH_SIZE = 16
+# 单个 (query, doc) 对的最大 token 数
+RERANK_MAX_LENGTH = 1024
+# GPU 上的序列长度分桶：子批次 padding 到不小于批内最长长度的最小桶，
+# 输入形状只有少数几种，编译生成的 CUDA Graph 可以按形状复用
+RERANK_LENGTH_BUCKETS = (64, 128, 256, 512, RERANK_MAX_LENGTH)
+# GPU 上的批大小分桶：子批次行数补齐到不小于实际行数的最小桶，
+# 小请求不会被补齐成满批
+RERANK_BATCH_BUCKETS = (1, 2, 4, 8, RERANK_BATCH_SIZE)
+
+
+def bucket_length(length: int) -> int:
+    """返回不小于 length 的最小分桶长度"""
+    return next((b for b in RERANK_LENGTH_BUCKETS if b >= length), RERANK_MAX_LENGTH)
+
+
+def bucket_rows(rows: int) -> int:
+    """返回不小于 rows 的最小批大小分桶"""
+    return next((b for b in RERANK_BATCH_BUCKETS if b >= rows), RERANK_BATCH_SIZE)
+
+
+def run_model(inputs) -> np.ndarray:
+    """对一个已分词的子批次执行前向计算，返回 FP32 分数"""
+    inputs = inputs.to(device)
+    # 只把最终的 logits 转回 FP32 用于序列化
+    return model(**inputs, return_dict=True).logits.view(-1, ).float().cpu().numpy()
+
+
+def forward_pairs(pairs: List[List[str]]) -> np.ndarray:
+    """用模型计算 (query, doc) 对的相关性分数，返回顺序与输入一致
+
+    先不做 padding 地分词得到每个对的真实长度，按长度排序后切分为子批次，
+    每个子批次只 padding 到批内最长长度（GPU 上长度和行数分别补齐到对应的分桶），
+    避免一个长文档让整批都 padding 到 max_length。
+    """
+    if not pairs:
+        return np.empty(0, dtype=np.float32)
+
+    encoded = tokenizer(pairs, truncation=True, max_length=RERANK_MAX_LENGTH)
+    features = [
+        {key: values[i] for key, values in encoded.items()} for i in range(len(pairs))
+    ]
+    order = sorted(range(len(pairs)), key=lambda i: len(features[i]["input_ids"]))
+
+    scores = np.empty(len(pairs), dtype=np.float32)
+    with torch.inference_mode(), torch.autocast(
+        device_type=device.type, dtype=model_dtype, enabled=device.type == "cuda"
+    ):
+        for start in range(0, len(order), RERANK_BATCH_SIZE):
+            batch_indices = order[start:start + RERANK_BATCH_SIZE]
+            batch_features = [features[i] for i in batch_indices]
+            if device.type == "cuda":
+                # 已按长度排序，子批次最后一个即为最长
+                longest = len(batch_features[-1]["input_ids"])
+                padding = {"padding": "max_length", "max_length": bucket_length(longest)}
+                # 用最后一个对把行数补齐到批大小分桶，使输入形状与预热时一致，多出的分数丢弃
+                batch_features += [batch_features[-1]] * (
+                    bucket_rows(len(batch_features)) - len(batch_features)
+                )
+            else:
+                padding = {"padding": "longest"}
+            inputs = tokenizer.pad(batch_features, return_tensors="pt", **padding)
+            # 按原始下标写回分数
+            scores[batch_indices] = run_model(inputs)[:len(batch_indices)]
+    return scores
+
+
+# 分数缓存的最大条目数
+RERANK_CACHE_SIZE = 100_000
+# (query, doc) 对的分数缓存，key 为两者编码后的 blake2b 摘要，按 LRU 淘汰
+# 只在推理线程中读写，无需加锁
+score_cache: "OrderedDict[bytes, float]" = OrderedDict()
+
+
+def pair_cache_key(pair: List[str]) -> bytes:
+    """计算 (query, doc) 对的缓存 key
+
+    query 前加上其字节长度，避免不同的 (query, doc) 拼接后得到相同的字节串
+    """
+    query, doc = (text.encode() for text in pair)
+    return hashlib.blake2b(
+        len(query).to_bytes(8, "little") + query + doc, digest_size=16
+    ).digest()
+
+
+def score_pairs(pairs: List[List[str]]) -> np.ndarray:
+    """计算 (query, doc) 对的相关性分数，返回顺序与输入一致
+
+    RAG 多轮对话中相同的文档会被反复重排，已缓存的对直接复用分数，
+    只有未命中缓存的对（去重后）才会送入模型。
+    """
+    scores = np.empty(len(pairs), dtype=np.float32)
+    # 未命中缓存的 key -> 该 key 在输入中出现的所有下标
+    missing: Dict[bytes, List[int]] = {}
+    for i, pair in enumerate(pairs):
+        key = pair_cache_key(pair)
+        cached = score_cache.get(key)
+        if cached is not None:
+            score_cache.move_to_end(key)
+            scores[i] = cached
+        else:
+            missing.setdefault(key, []).append(i)
+
+    if missing:
+        missing_scores = forward_pairs([pairs[idx[0]] for idx in missing.values()])
+        for (key, indices), score_val in zip(missing.items(), missing_scores.tolist()):
+            scores[indices] = score_val
+            score_cache[key] = score_val
+        while len(score_cache) > RERANK_CACHE_SIZE:
+            score_cache.popitem(last=False)
+    return scores
+
+
+# 推理固定在同一个线程中执行，编译生成的 CUDA Graph 状态与线程绑定
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+if device.type == "cuda":
+    # 编译模型以融合算子并减少逐层的 Python 调度开销，dynamic=True 使各分桶形状共用编译结果；
+    # reduce-overhead 模式会为每种输入形状捕获 CUDA Graph，之后直接 replay
+    print("正在编译模型...")
+    model = torch.compile(model, mode="reduce-overhead", dynamic=True)
+
+    def warmup():
+        """按 (批大小分桶 × 长度分桶) 的每种形状预热，在服务启动前完成编译和 CUDA Graph 捕获
+
+        GPU 上的子批次总是补齐到这些形状之一，服务期间不会再捕获新的 CUDA Graph
+        """
+        with torch.inference_mode(), torch.autocast(
+            device_type=device.type, dtype=model_dtype
+        ):
+            for rows in RERANK_BATCH_BUCKETS:
+                for bucket in RERANK_LENGTH_BUCKETS:
+                    inputs = tokenizer(
+                        [["warmup", "warmup"]] * rows,
+                        padding="max_length",
+                        truncation=True,
+                        max_length=bucket,
+                        return_tensors="pt",
+                    )
+                    run_model(inputs)
+
+    inference_executor.submit(warmup).result()
+    print("模型编译完成！")
+
+
+# --- 请求合并：把短时间窗口内到达的多个请求合并为一次推理 ---
+# 收集请求的最长等待时间（秒）
+RERANK_COALESCE_WINDOW = 0.005
+# 单次合并的最大请求数
+RERANK_COALESCE_MAX_REQUESTS = 32
+
+# 队列元素为 (pairs, future)，future 的结果为该请求对应的分数数组
+rerank_queue: Optional["asyncio.Queue[Tuple[List[List[str]], asyncio.Future]]"] = None
+
+
+async def rerank_worker():
+    """后台协程：从队列中收集请求，合并后推理一次，再按请求边界拆分分数"""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await rerank_queue.get()]
+        deadline = loop.time() + RERANK_COALESCE_WINDOW
+        while len(items) < RERANK_COALESCE_MAX_REQUESTS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(rerank_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        all_pairs = [pair for pairs, _ in items for pair in pairs]
+        try:
+            # 推理放到专用线程中执行，避免阻塞事件循环
+            scores = await loop.run_in_executor(
+                inference_executor, score_pairs, all_pairs
+            )
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        offset = 0
+        for pairs, future in items:
+            if not future.done():
+                future.set_result(scores[offset:offset + len(pairs)])
+            offset += len(pairs)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    global rerank_queue
+    rerank_queue = asyncio.Queue()
+    worker = asyncio.create_task(rerank_worker())
+    yield
+    worker.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await worker
+
+
 # --- 3. 创建FastAPI应用 ---
 app = FastAPI(
     title="Reranker API (Test Version)",
     description="一个返回 'score' 字段以测试Go客户端兼容性的API服务",
-    version="1.0.1"
+    version="1.0.1",
+    lifespan=lifespan,
+    # 优先使用 orjson 序列化响应，大量文档时比默认的 json.dumps 快得多
+    default_response_class=DefaultResponse,
 )
 
 # --- 4. 定义API端点 ---
 # --- 修改开始：将 response_model 指向新的测试用响应结构 ---
 @app.post("/rerank", response_model=TestFinalResponse) # <--- 【关键修改点】response_model 改为 TestFinalResponse
-def rerank_endpoint(request: RerankRequest):
+async def rerank_endpoint(request: RerankRequest):
     # --- 修改结束 ---
 
     pairs = [[request.query, doc] for doc in request.documents]
-
-    with torch.no_grad():
-        inputs = tokenizer(pairs, padding=True, truncation=True, return_tensors='pt', max_length=1024).to(device)
-        scores = model(**inputs, return_dict=True).logits.view(-1, ).float()
+    # 交给后台协程与其他并发请求合并推理
+    future = asyncio.get_running_loop().create_future()
+    await rerank_queue.put((pairs, future))
+    scores = await future
 
     # --- 修改开始：按照测试用的结构来构建结果 ---
-    results = []
-    for i, (text, score_val) in enumerate(zip(request.documents, scores)):
-        
-        # 1. 创建嵌套的 document 对象
-        doc_info = DocumentInfo(text=text)
-        
-        # 2. 创建 TestRankResult 对象
-        #    注意字段名：index, document, score
-        test_result = TestRankResult(
-            index=i,
-            document=doc_info,
-            score=score_val.item()  # <--- 【关键修改点】赋值给 "score" 字段
-        )
-        results.append(test_result)
-
-    # 3. 排序 (key 也要相应修改为 score)
-    sorted_results = sorted(results, key=lambda x: x.score, reverse=True)
+    # 用 NumPy 按 score 降序排序（stable 保证同分时保持原始顺序），
+    # 再按排好的顺序直接构建普通字典（字段名：index, document, score），
+    # 由 FastAPI 根据 response_model 统一验证一次
+    order = np.argsort(-scores, kind="stable").tolist()
+    score_list = scores.tolist()
+    sorted_results = [
+        {"index": i, "document": {"text": request.documents[i]}, "score": score_list[i]}
+        for i in order
+    ]
     # --- 修改结束 ---
-    
+
     # 返回一个字典，FastAPI 会根据 response_model (TestFinalResponse) 来验证和序列化它
     # 最终生成的 JSON 会是 {"results": [{"index": ..., "document": ..., "score": ...}]}
     return {"results": sorted_results}